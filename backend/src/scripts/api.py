@@ -1,12 +1,13 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import FileResponse
 from pydantic import BaseModel, HttpUrl
 from typing import Optional, List, Dict, Any
 import time
 import os
 from pathlib import Path
-from utils import process_url_with_markitdown, GeminiClientWrapper, inject_page_markers_into_markdown, get_pdf_page_count
-from markitdown import MarkItDown
-import google.generativeai as genai
+from utils import process_url_with_markitdown, process_file_with_markitdown
+from profiling import ConversionProfiler, list_profiles, get_profile, get_profile_artifact
+from formats import UnsupportedFormatError
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
@@ -17,18 +18,9 @@ app = FastAPI(
     version="1.0.0",
 )
 
-gemini_api_key = os.getenv("GOOGLE_GENAI_API_KEY")
-if gemini_api_key:
-    genai.configure(api_key=gemini_api_key)
-    gemini_client = GeminiClientWrapper()
-    md = MarkItDown(llm_client=gemini_client, llm_model="gemini-2.5-flash")
-else:
-    md = MarkItDown()
-    print("⚠️ MarkItDown initialized without LLM (no GOOGLE_GENAI_API_KEY found)")
-
-
 class URLRequest(BaseModel):
     url: HttpUrl
+    profile: bool = False  # Capture a CPU profile of this conversion
 
     class Config:
         json_schema_extra = {"example": {"url": "https://example.com/document.pdf"}}
@@ -36,6 +28,7 @@ class URLRequest(BaseModel):
 
 class FilePathRequest(BaseModel):
     file_path: str
+    profile: bool = False  # Capture a CPU profile of this conversion
 
     class Config:
         json_schema_extra = {"example": {"file_path": "/path/to/uploads/document.pdf"}}
@@ -50,6 +43,7 @@ class ProcessingResponse(BaseModel):
     error_message: Optional[str] = None
     cached: bool = False
     processing_strategy: Optional[str] = None  # 'batch_pdf' | 'batch_text' | 'rag'
+    profile_id: Optional[str] = None  # Set when a profile was captured, see GET /admin/profiles
 
     class Config:
         json_schema_extra = {
@@ -78,6 +72,8 @@ async def root():
             "GET /health": "Health check endpoint",
             "GET /cache-stats": "View cache statistics",
             "DELETE /cache": "Clear all cached content",
+            "GET /admin/profiles": "List captured conversion profiles",
+            "GET /admin/profiles/{profile_id}/download": "Download a captured profile",
         },
     }
 
@@ -101,48 +97,19 @@ async def process_url_endpoint(request: URLRequest):
     - **rag**: PDF with ≥200 pages (markdown generated)
 
     Files larger than 150MB are rejected.
-    ZIP files are not supported.
+    ZIP archives are not supported (EPUB books are).
+    Cached results older than URL_CACHE_MAX_AGE seconds are revalidated with
+    the origin using ETag/Last-Modified before being reused.
     """
     url_str = str(request.url)
     start_time = time.time()
+    profiler = ConversionProfiler(url_str, enabled=request.profile)
 
     try:
-        # Check if content is cached before processing
-        from utils import get_cached_content
-
-        cached_content, cached_strategy = get_cached_content(url_str)
-        is_cached = cached_strategy is not None  # We have a cached result
-
-        # If content is cached, return it immediately
-        if is_cached:
-            processing_time = time.time() - start_time
-
-            # Handle cached batch_pdf case
-            if cached_strategy == "batch_pdf":
-                return ProcessingResponse(
-                    success=True,
-                    url=url_str,
-                    processing_time=processing_time,
-                    content_length=0,
-                    markdown_content=None,
-                    error_message=None,
-                    cached=True,
-                    processing_strategy=cached_strategy,
-                )
-            else:
-                return ProcessingResponse(
-                    success=True,
-                    url=url_str,
-                    processing_time=processing_time,
-                    content_length=len(cached_content) if cached_content else 0,
-                    markdown_content=cached_content,
-                    error_message=None,
-                    cached=True,
-                    processing_strategy=cached_strategy,
-                )
-
-        # Process the URL
-        result, processing_strategy = process_url_with_markitdown(url_str)
+        # Fresh cache hits return immediately; stale entries are revalidated
+        # (a revalidated entry still counts as cached)
+        with profiler:
+            result, processing_strategy, is_cached = process_url_with_markitdown(url_str)
 
         processing_time = time.time() - start_time
 
@@ -155,8 +122,9 @@ async def process_url_endpoint(request: URLRequest):
                 content_length=0,
                 markdown_content=None,
                 error_message=None,
-                cached=False,
+                cached=is_cached,
                 processing_strategy=processing_strategy,
+                profile_id=profiler.profile_id,
             )
         elif result is not None:
             return ProcessingResponse(
@@ -166,8 +134,9 @@ async def process_url_endpoint(request: URLRequest):
                 content_length=len(result),
                 markdown_content=result,
                 error_message=None,
-                cached=False,
+                cached=is_cached,
                 processing_strategy=processing_strategy,
+                profile_id=profiler.profile_id,
             )
         else:
             return ProcessingResponse(
@@ -179,6 +148,7 @@ async def process_url_endpoint(request: URLRequest):
                 error_message="Failed to process URL. Possible reasons: file too large (>150MB), ZIP file, network error, or unsupported format.",
                 cached=False,
                 processing_strategy=None,
+                profile_id=profiler.profile_id,
             )
 
     except Exception as e:
@@ -193,6 +163,7 @@ async def process_url_endpoint(request: URLRequest):
             error_message=f"Unexpected error: {str(e)}",
             cached=False,
             processing_strategy=None,
+            profile_id=profiler.profile_id,
         )
 
 
@@ -204,10 +175,15 @@ async def process_file_endpoint(request: FilePathRequest):
     - **file_path**: Absolute path to the file on the filesystem
 
     Returns the markdown content.
-    Files larger than 100MB are rejected.
+    Files larger than 100MB are rejected. The format is detected from the file
+    content; unsupported or encrypted files and files over their format's size
+    or page limits are rejected before conversion.
+    Results are cached by file content, so files pre-warmed with
+    `python prewarm.py` are returned without re-conversion.
     """
     file_path = request.file_path
     start_time = time.time()
+    profiler = ConversionProfiler(file_path, enabled=request.profile)
 
     try:
         # Validate file exists
@@ -238,27 +214,10 @@ async def process_file_endpoint(request: FilePathRequest):
                 processing_strategy=None,
             )
 
-        # Process file with MarkItDown
-        print(f"🔄 Processing file: {file_path}")
-        result = md.convert(file_path)
-        markdown_content = result.text_content
-        
-        is_pdf = file_path.lower().endswith('.pdf')
-        page_count = None
-        
-        if is_pdf:
-            page_count = get_pdf_page_count(file_path)
-            print(f"📄 PDF detected: {page_count} pages")
-            
-            if page_count and page_count > 0:
-                before_length = len(markdown_content)
-                markdown_content = inject_page_markers_into_markdown(markdown_content, file_path, page_count)
-                after_length = len(markdown_content)
-                marker_count = markdown_content.count('<!-- Page')
-                print(f"✓ Page marker injection: {before_length} → {after_length} chars, {marker_count} markers added")
-            else:
-                print(f"⚠️ Could not get page count, skipping page markers")
-        
+        # Process file with MarkItDown (served from cache when pre-warmed)
+        with profiler:
+            markdown_content, is_cached = process_file_with_markitdown(file_path)
+
         processing_time = time.time() - start_time
         content_length = len(markdown_content)
 
@@ -271,8 +230,9 @@ async def process_file_endpoint(request: FilePathRequest):
             content_length=content_length,
             markdown_content=markdown_content,
             error_message=None,
-            cached=False,
+            cached=is_cached,
             processing_strategy="local_file",
+            profile_id=profiler.profile_id,
         )
 
     except Exception as e:
@@ -280,7 +240,9 @@ async def process_file_endpoint(request: FilePathRequest):
         error_str = str(e)
         print(f"❌ Error processing file: {error_str}")
         
-        if "GEMINI_RATE_LIMIT" in error_str:
+        if isinstance(e, UnsupportedFormatError):
+            error_message = f"Unsupported file: {error_str}"
+        elif "GEMINI_RATE_LIMIT" in error_str:
             error_message = "Google Gemini API RateLimit Hit"
         elif "GEMINI_INTERNAL_ERROR" in error_str:
             error_message = "Google Gemini API Internal Server Error"
@@ -298,16 +260,17 @@ async def process_file_endpoint(request: FilePathRequest):
             error_message=error_message,
             cached=False,
             processing_strategy=None,
+            profile_id=profiler.profile_id,
         )
 
 
 @app.get("/cache-stats")
 async def get_cache_stats():
-    """Get statistics about the cache."""
-    from utils import CACHE_DIR
+    """Get statistics about the cache, including per-tier hit metrics."""
+    from utils import CACHE_DIR, conversion_cache
 
     try:
-        cache_files = list(CACHE_DIR.glob("*.json"))
+        cache_files = conversion_cache.l1.files()
         total_files = len(cache_files)
 
         total_size = sum(f.stat().st_size for f in cache_files if f.exists())
@@ -318,6 +281,7 @@ async def get_cache_stats():
             "total_cached_files": total_files,
             "total_cache_size_mb": round(total_size_mb, 2),
             "cache_files": [f.name for f in cache_files],
+            **conversion_cache.stats(),
         }
     except Exception as e:
         raise HTTPException(
@@ -326,29 +290,51 @@ async def get_cache_stats():
 
 
 @app.delete("/cache")
-async def clear_cache():
-    """Clear all cached content."""
-    from utils import CACHE_DIR
+async def clear_cache(local_only: bool = False):
+    """
+    Clear all cached content.
 
-    try:
-        cache_files = list(CACHE_DIR.glob("*.json"))
-        deleted_count = 0
+    - **local_only**: Only clear this replica's local cache, keeping the shared L2
+    """
+    from utils import conversion_cache
 
-        for cache_file in cache_files:
-            try:
-                cache_file.unlink()
-                deleted_count += 1
-            except Exception:
-                pass
+    try:
+        deleted = conversion_cache.clear(include_shared=not local_only)
+        deleted_count = deleted["l1"]
 
         return {
             "message": f"Cache cleared successfully. Deleted {deleted_count} files.",
             "deleted_files": deleted_count,
+            "deleted_shared_entries": deleted.get("l2"),
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error clearing cache: {str(e)}")
 
 
+@app.get("/admin/profiles")
+async def get_profiles():
+    """List captured conversion profiles, newest first."""
+    return {"profiles": list_profiles()}
+
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile_details(profile_id: str):
+    """Get a profile's metadata: file type, page count, stage timings and hot functions."""
+    profile = get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile not found: {profile_id}")
+    return profile
+
+
+@app.get("/admin/profiles/{profile_id}/download")
+async def download_profile(profile_id: str):
+    """Download the raw profile (.prof for cProfile, collapsed stacks .txt for sampled)."""
+    artifact = get_profile_artifact(profile_id)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail=f"Profile not found: {profile_id}")
+    return FileResponse(artifact, filename=artifact.name, media_type="application/octet-stream")
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,322 @@
+"""
+Two-tier conversion cache.
+
+L1 is the replica-local cache directory (CACHE_DIR). L2 is an optional shared
+backend that every replica reads from and writes to, so a document converted
+by one replica is served from cache by all of them and survives redeploys:
+
+    CACHE_L2_BACKEND=directory  CACHE_L2_DIR=/mnt/shared/url_cache
+    CACHE_L2_BACKEND=redis      CACHE_L2_URL=redis://cache:6379/0  (CACHE_L2_TIMEOUT=1.0 seconds)
+
+Reads go L1 → L2 (an L2 hit is copied into L1); writes go to both tiers.
+A stale L1 entry is checked against L2 before it is revalidated, so a
+revalidation done by one replica is picked up by the others.
+L2 failures are logged and counted but never fail a conversion.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import zlib
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Callable
+
+
+class CacheBackend:
+    """Minimal byte-oriented key/value interface implemented by every tier."""
+
+    name = "base"
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class DirectoryBackend(CacheBackend):
+    """
+    Stores one `<key>.json` file per entry.
+
+    Used for the local L1 and for a shared L2 directory (NFS, EFS, a mounted
+    volume). Writes go through a temporary file and an atomic rename so that
+    replicas never read a partially written entry.
+    """
+
+    name = "directory"
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, value: bytes) -> None:
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.replace(temp_path, self._path(key))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def files(self) -> List[Path]:
+        return list(self.directory.glob("*.json"))
+
+    def clear(self) -> int:
+        deleted_count = 0
+        for cache_file in self.files():
+            try:
+                cache_file.unlink()
+                deleted_count += 1
+            except Exception:
+                pass
+        return deleted_count
+
+    def stats(self) -> Dict[str, Any]:
+        cache_files = self.files()
+        total_size = sum(f.stat().st_size for f in cache_files if f.exists())
+        return {
+            "backend": self.name,
+            "location": str(self.directory),
+            "entries": len(cache_files),
+            "size_mb": round(total_size / (1024 * 1024), 2),
+        }
+
+
+class RedisBackend(CacheBackend):
+    """
+    Stores entries in a Redis-compatible server.
+
+    Any client exposing redis-py's get/set/delete/scan_iter can be passed in,
+    which is how the backend is exercised against a local stand-in.
+    """
+
+    name = "redis"
+
+    def __init__(self, client, prefix: str = "rag-parsing:cache:", ttl: Optional[int] = None):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    @classmethod
+    def from_url(cls, url: str, timeout: float = 1.0, **kwargs) -> "RedisBackend":
+        """
+        Connect to a Redis URL.
+
+        redis-py waits forever by default; a short timeout keeps a hung or
+        unreachable L2 from blocking conversions (the error is counted and the
+        lookup falls through to a miss).
+        """
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_L2_BACKEND=redis requires the 'redis' package (pip install redis)") from e
+        client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        return cls(client, **kwargs)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes) -> None:
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+    def clear(self) -> int:
+        deleted_count = 0
+        for redis_key in self.client.scan_iter(match=f"{self.prefix}*"):
+            deleted_count += self.client.delete(redis_key)
+        return deleted_count
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "prefix": self.prefix, "ttl": self.ttl}
+
+
+def encode_entry(cache_data: Dict[str, Any], compress: bool) -> bytes:
+    payload = json.dumps(cache_data, indent=None if compress else 2).encode("utf-8")
+    return zlib.compress(payload, 6) if compress else payload
+
+
+def decode_entry(payload: bytes) -> Dict[str, Any]:
+    # Plain JSON entries start with "{"; anything else is a zlib stream
+    if payload[:1] != b"{":
+        payload = zlib.decompress(payload)
+    return json.loads(payload)
+
+
+class TieredCache:
+    """Read-through / write-through cache over a local L1 and an optional shared L2."""
+
+    def __init__(self, l1: CacheBackend, l2: Optional[CacheBackend] = None, l2_compression: bool = True):
+        self.l1 = l1
+        self.l2 = l2
+        self.l2_compression = l2_compression
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self._metrics = {
+            tier: {"hits": 0, "misses": 0, "writes": 0, "errors": 0} for tier in ("l1", "l2")
+        }
+
+    def _count(self, tier: str, metric: str) -> None:
+        with self._lock:
+            self._metrics[tier][metric] += 1
+
+    def _read(self, tier: str, backend: CacheBackend, key: str) -> Optional[Dict[str, Any]]:
+        """Read and decode an entry; hits and misses are counted by get()."""
+        try:
+            payload = backend.get(key)
+        except Exception as e:
+            print(f"⚠️ Cache {tier} read failed for {key}: {e}")
+            self._count(tier, "errors")
+            return None
+
+        if payload is None:
+            return None
+
+        try:
+            return decode_entry(payload)
+        except (json.JSONDecodeError, zlib.error, UnicodeDecodeError):
+            # If cache entry is corrupted, remove it
+            print(f"⚠️ Corrupted {tier} cache entry {key} - removing")
+            self._delete(tier, backend, key)
+            return None
+
+    def _write(self, tier: str, backend: CacheBackend, key: str, payload: bytes) -> None:
+        try:
+            backend.set(key, payload)
+            self._count(tier, "writes")
+        except Exception as e:
+            print(f"⚠️ Cache {tier} write failed for {key}: {e}")
+            self._count(tier, "errors")
+
+    def _delete(self, tier: str, backend: CacheBackend, key: str) -> None:
+        try:
+            backend.delete(key)
+        except Exception as e:
+            print(f"⚠️ Cache {tier} delete failed for {key}: {e}")
+            self._count(tier, "errors")
+
+    def get(
+        self, key: str, is_stale: Optional[Callable[[Dict[str, Any]], bool]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Read an entry, preferring L1.
+
+        When `is_stale` flags the L1 copy, L2 is consulted as well: another
+        replica may already have revalidated or reconverted the entry, and its
+        copy replaces the local one if it is not stale itself.
+
+        Each call counts exactly one outcome: a hit on the tier that served the
+        entry, and a miss on every tier that was consulted but did not.
+        """
+        with self._lock:
+            self._lookups += 1
+
+        cache_data = self._read("l1", self.l1, key)
+        if cache_data is not None and (
+            self.l2 is None or is_stale is None or not is_stale(cache_data)
+        ):
+            self._count("l1", "hits")
+            return cache_data
+        if self.l2 is None:
+            self._count("l1", "misses")
+            return None
+
+        shared_data = self._read("l2", self.l2, key)
+        if shared_data is None or (cache_data is not None and is_stale(shared_data)):
+            # Nothing newer in L2; fall back to the (possibly stale) local copy
+            self._count("l2", "misses")
+            self._count("l1", "hits" if cache_data is not None else "misses")
+            return cache_data
+
+        self._count("l1", "misses")
+        self._count("l2", "hits")
+        # Promote to L1 so the next read on this replica stays local
+        self._write("l1", self.l1, key, encode_entry(shared_data, compress=False))
+        return shared_data
+
+    def set(self, key: str, cache_data: Dict[str, Any]) -> None:
+        self._write("l1", self.l1, key, encode_entry(cache_data, compress=False))
+        if self.l2 is not None:
+            self._write("l2", self.l2, key, encode_entry(cache_data, compress=self.l2_compression))
+
+    def delete(self, key: str) -> None:
+        self._delete("l1", self.l1, key)
+        if self.l2 is not None:
+            self._delete("l2", self.l2, key)
+
+    def clear(self, include_shared: bool = True) -> Dict[str, int]:
+        deleted = {"l1": self.l1.clear()}
+        if self.l2 is not None and include_shared:
+            try:
+                deleted["l2"] = self.l2.clear()
+            except Exception as e:
+                print(f"⚠️ Cache l2 clear failed: {e}")
+                self._count("l2", "errors")
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._lookups
+            metrics = {tier: dict(values) for tier, values in self._metrics.items()}
+
+        tiers = {"l1": {**self.l1.stats(), **metrics["l1"]}}
+        if self.l2 is not None:
+            try:
+                l2_stats = self.l2.stats()
+            except Exception as e:
+                l2_stats = {"backend": self.l2.name, "error": str(e)}
+            tiers["l2"] = {**l2_stats, "compression": self.l2_compression, **metrics["l2"]}
+
+        hits = metrics["l1"]["hits"] + metrics["l2"]["hits"]
+        return {
+            "tiers": tiers,
+            "lookups": lookups,
+            "hit_ratio": round(hits / lookups, 4) if lookups else None,
+        }
+
+
+def create_l2_backend_from_env() -> Optional[CacheBackend]:
+    """Build the shared L2 backend from CACHE_L2_* environment variables, if configured."""
+    backend = os.getenv("CACHE_L2_BACKEND", "").lower()
+
+    if not backend or backend == "none":
+        return None
+    if backend == "directory":
+        l2_dir = os.getenv("CACHE_L2_DIR")
+        if not l2_dir:
+            raise RuntimeError("CACHE_L2_BACKEND=directory requires CACHE_L2_DIR")
+        return DirectoryBackend(Path(l2_dir))
+    if backend == "redis":
+        ttl = os.getenv("CACHE_L2_TTL")
+        return RedisBackend.from_url(
+            os.getenv("CACHE_L2_URL", "redis://localhost:6379/0"),
+            timeout=float(os.getenv("CACHE_L2_TIMEOUT", "1.0")),
+            ttl=int(ttl) if ttl else None,
+        )
+
+    raise RuntimeError(f"Unknown CACHE_L2_BACKEND: {backend}")
@@ -0,0 +1,327 @@
+"""
+Content-based format detection and direct dispatch to MarkItDown converters.
+
+MarkItDown.convert() guesses the type of every file (extension, magika) and
+then probes each registered converter in turn. Uploads are often misnamed and
+URL downloads are stored as `.tmp`, so instead the format is sniffed from the
+file's leading bytes (or its ZIP / OLE directory for Office documents) and the
+file is handed straight to a pre-initialized converter for that format.
+
+Unsupported content (plain ZIP archives, encrypted documents, legacy binary
+Word/PowerPoint, unknown binaries) and files over their format's limits are
+rejected before any expensive parsing. Formats without a dedicated converter
+entry are still converted, through MarkItDown with the detected type as a hint.
+"""
+
+import os
+import zipfile
+from dataclasses import dataclass
+from typing import Optional, Dict, Any
+
+SNIFF_BYTES = 8192
+
+
+class UnsupportedFormatError(Exception):
+    """Raised when a file's format is unsupported or exceeds its format limits."""
+
+
+@dataclass(frozen=True)
+class FormatSpec:
+    extension: str
+    mimetype: str
+    converter: Optional[str]  # Class name in markitdown.converters
+    max_bytes: int
+    max_pages: Optional[int] = None  # Pages, slides or sheets, when the format has them
+
+
+MB = 1024 * 1024
+
+FORMAT_SPECS: Dict[str, FormatSpec] = {
+    "pdf": FormatSpec(".pdf", "application/pdf", "PdfConverter", 100 * MB, int(os.getenv("PDF_MAX_PAGES", "2000"))),
+    "docx": FormatSpec(
+        ".docx",
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        "DocxConverter",
+        50 * MB,
+    ),
+    "pptx": FormatSpec(
+        ".pptx",
+        "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+        "PptxConverter",
+        100 * MB,
+        int(os.getenv("PPTX_MAX_SLIDES", "500")),
+    ),
+    "xlsx": FormatSpec(
+        ".xlsx",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "XlsxConverter",
+        50 * MB,
+        int(os.getenv("XLSX_MAX_SHEETS", "100")),
+    ),
+    "xls": FormatSpec(".xls", "application/vnd.ms-excel", "XlsConverter", 50 * MB),
+    "msg": FormatSpec(".msg", "application/vnd.ms-outlook", "OutlookMsgConverter", 25 * MB),
+    "png": FormatSpec(".png", "image/png", "ImageConverter", 20 * MB),
+    "jpeg": FormatSpec(".jpg", "image/jpeg", "ImageConverter", 20 * MB),
+    # MarkItDown's ImageConverter only accepts PNG/JPEG; let it pick for these
+    "gif": FormatSpec(".gif", "image/gif", None, 20 * MB),
+    "webp": FormatSpec(".webp", "image/webp", None, 20 * MB),
+    "epub": FormatSpec(".epub", "application/epub+zip", "EpubConverter", 100 * MB),
+    "html": FormatSpec(".html", "text/html", "HtmlConverter", 20 * MB),
+    "csv": FormatSpec(".csv", "text/csv", "CsvConverter", 50 * MB),
+    "json": FormatSpec(".json", "application/json", "PlainTextConverter", 20 * MB),
+    "ipynb": FormatSpec(".ipynb", "application/x-ipynb+json", "IpynbConverter", 20 * MB),
+    "rss": FormatSpec(".xml", "application/rss+xml", "RssConverter", 20 * MB),
+    # Other XML documents: let MarkItDown pick (plain text unless a converter claims it)
+    "xml": FormatSpec(".xml", "text/xml", None, 20 * MB),
+    "text": FormatSpec(".txt", "text/plain", "PlainTextConverter", 20 * MB),
+}
+
+
+@dataclass
+class DetectedFormat:
+    format: str
+    spec: FormatSpec
+    size: int
+    page_count: Optional[int] = None
+    charset: Optional[str] = None  # Only set for text files with a byte order mark
+
+
+def _sniff_zip(file_path: str) -> tuple[str, Optional[int]]:
+    """
+    Classify a ZIP container by its central directory.
+
+    Only EPUB's tiny `mimetype` member is ever read; nothing else is decompressed.
+    """
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            infos = archive.infolist()
+            mimetype = b""
+            if any(info.filename == "mimetype" and info.file_size <= 64 for info in infos):
+                mimetype = archive.read("mimetype").strip()
+    except (zipfile.BadZipFile, RuntimeError):
+        # RuntimeError: the mimetype member itself is encrypted
+        raise UnsupportedFormatError("Corrupted or encrypted ZIP container")
+
+    if any(info.flag_bits & 0x1 for info in infos):
+        raise UnsupportedFormatError("Encrypted ZIP archives are not supported")
+
+    names = [info.filename for info in infos]
+    if "word/document.xml" in names:
+        return "docx", None
+    if "ppt/presentation.xml" in names:
+        return "pptx", sum(1 for n in names if n.startswith("ppt/slides/slide") and n.endswith(".xml"))
+    if "xl/workbook.xml" in names:
+        return "xlsx", sum(1 for n in names if n.startswith("xl/worksheets/sheet") and n.endswith(".xml"))
+    if mimetype == b"application/epub+zip" or "META-INF/container.xml" in names:
+        return "epub", None
+
+    raise UnsupportedFormatError("ZIP archives are not supported")
+
+
+def _sniff_ole(file_path: str) -> str:
+    """Classify an OLE compound file (legacy Office, Outlook, encrypted OOXML) by its stream names."""
+    try:
+        import olefile
+    except ImportError:
+        raise UnsupportedFormatError("Legacy Office documents are not supported")
+
+    with olefile.OleFileIO(file_path) as ole:
+        streams = {"/".join(entry) for entry in ole.listdir(streams=True, storages=True)}
+
+    if "EncryptionInfo" in streams or "EncryptedPackage" in streams:
+        raise UnsupportedFormatError("Password-protected Office documents are not supported")
+    if any(name.startswith("__substg1.0_") for name in streams):
+        return "msg"
+    if "Workbook" in streams or "Book" in streams:
+        return "xls"
+    if "WordDocument" in streams:
+        raise UnsupportedFormatError("Legacy .doc files are not supported, please convert to .docx")
+    if "PowerPoint Document" in streams:
+        raise UnsupportedFormatError("Legacy .ppt files are not supported, please convert to .pptx")
+
+    raise UnsupportedFormatError("Unsupported OLE compound document")
+
+
+def _inspect_pdf(file_path: str) -> Optional[int]:
+    """Reject PDFs that cannot be opened without a password and return the page count."""
+    import PyPDF2
+
+    try:
+        reader = PyPDF2.PdfReader(file_path)
+    except Exception as e:
+        # Leave malformed PDFs to the converter, which is more lenient
+        print(f"Could not determine PDF page count: {e}")
+        return None
+
+    if reader.is_encrypted:
+        # Owner-password-only PDFs (permissions) open with an empty user password
+        try:
+            decrypted = reader.decrypt("")
+        except Exception:
+            decrypted = False
+        if not decrypted:
+            raise UnsupportedFormatError("Password-protected PDFs are not supported")
+
+    try:
+        return len(reader.pages)
+    except Exception as e:
+        print(f"Could not determine PDF page count: {e}")
+        return None
+
+
+# Text sub-formats that cannot be told apart from plain text by content alone
+TEXT_CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/json": "json",
+    "application/x-ipynb+json": "ipynb",
+    "text/html": "html",
+    "application/xhtml+xml": "html",
+    "text/xml": "xml",
+    "application/xml": "xml",
+    "application/rss+xml": "rss",
+    "application/atom+xml": "rss",
+}
+
+# UTF-32 first: its little-endian BOM starts with the UTF-16 one
+TEXT_BOMS = [
+    (b"\x00\x00\xfe\xff", "utf-32-be"),
+    (b"\xff\xfe\x00\x00", "utf-32-le"),
+    (b"\xef\xbb\xbf", "utf-8-sig"),
+    (b"\xfe\xff", "utf-16-be"),
+    (b"\xff\xfe", "utf-16-le"),
+]
+
+
+def _sniff_text(head: bytes, extension: str, content_type: Optional[str]) -> tuple[str, Optional[str]]:
+    """
+    Classify a text file, returning its format and the charset implied by a byte order mark.
+
+    The filename extension is trusted first, then the content. The server's
+    Content-Type only decides for text that the content alone does not identify
+    (CSV, HTML fragments, XML without a prolog).
+    """
+    charset = next((name for bom, name in TEXT_BOMS if head.startswith(bom)), None)
+    if charset is not None:
+        # UTF-16/32 text is full of NUL bytes; sniff the decoded text instead
+        head = head.decode(charset, errors="ignore").encode("utf-8")
+    elif b"\x00" in head:
+        raise UnsupportedFormatError("Unsupported binary file format")
+
+    text = head.lstrip().lower()
+    if text.startswith((b"<!doctype html", b"<html")) or b"<html" in text[:1024]:
+        return "html", charset
+    if extension in (".csv", ".json", ".ipynb"):
+        return extension[1:], charset
+    if text.startswith(b"{") and (b'"cells"' in text[:256] or b'"nbformat"' in text):
+        return "ipynb", charset
+    if text.startswith((b"{", b"[")):
+        return "json", charset
+    if text.startswith((b"<?xml", b"<rss", b"<feed")):
+        if b"<rss" in text or b"<feed" in text or b"<rdf:rdf" in text:
+            return "rss", charset
+        return "xml", charset
+
+    media_type = (content_type or "").split(";", 1)[0].strip().lower()
+    if media_type in TEXT_CONTENT_TYPES:
+        return TEXT_CONTENT_TYPES[media_type], charset
+    if media_type.endswith("+json"):
+        return "json", charset
+    return "text", charset
+
+
+def detect_format(
+    file_path: str, filename_hint: Optional[str] = None, content_type: Optional[str] = None
+) -> DetectedFormat:
+    """
+    Detect a file's format from its content and enforce that format's limits.
+
+    Args:
+        file_path: Path to the file on disk
+        filename_hint: Original name or URL, only used to tell CSV/JSON/notebooks apart from plain text
+        content_type: Content-Type of a download, used the same way when the name does not help
+
+    Raises:
+        UnsupportedFormatError: for unsupported, encrypted or over-limit files
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+
+    extension = os.path.splitext((filename_hint or file_path).split("?", 1)[0])[1].lower()
+    page_count = None
+    charset = None
+
+    if b"%PDF-" in head[:1024]:
+        file_format = "pdf"
+    elif head.startswith(b"PK\x03\x04"):
+        file_format, page_count = _sniff_zip(file_path)
+    elif head.startswith(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"):
+        file_format = _sniff_ole(file_path)
+    elif head.startswith(b"\x89PNG\r\n\x1a\n"):
+        file_format = "png"
+    elif head.startswith(b"\xff\xd8\xff"):
+        file_format = "jpeg"
+    elif head.startswith((b"GIF87a", b"GIF89a")):
+        file_format = "gif"
+    elif head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        file_format = "webp"
+    elif head.startswith((b"PK\x05\x06", b"\x1f\x8b", b"Rar!", b"7z\xbc\xaf\x27\x1c")):
+        raise UnsupportedFormatError("Archives are not supported")
+    else:
+        file_format, charset = _sniff_text(head, extension, content_type)
+
+    spec = FORMAT_SPECS[file_format]
+    if size > spec.max_bytes:
+        raise UnsupportedFormatError(
+            f"File too large: {size / MB:.2f}MB exceeds {spec.max_bytes // MB}MB limit for {file_format}"
+        )
+
+    if file_format == "pdf":
+        page_count = _inspect_pdf(file_path)
+
+    if spec.max_pages is not None and page_count is not None and page_count > spec.max_pages:
+        raise UnsupportedFormatError(
+            f"Document too long: {page_count} pages exceeds {spec.max_pages} page limit for {file_format}"
+        )
+
+    return DetectedFormat(format=file_format, spec=spec, size=size, page_count=page_count, charset=charset)
+
+
+def build_converter_registry() -> Dict[str, Any]:
+    """Instantiate one MarkItDown converter per format up front."""
+    from markitdown import converters
+
+    registry = {}
+    for file_format, spec in FORMAT_SPECS.items():
+        converter_class = getattr(converters, spec.converter, None) if spec.converter else None
+        if converter_class is None:
+            continue
+        try:
+            registry[file_format] = converter_class()
+        except Exception as e:
+            print(f"⚠️ Could not initialize {spec.converter}: {e}")
+    return registry
+
+
+def convert_detected(md, registry: Dict[str, Any], file_path: str, detected: DetectedFormat, **kwargs) -> str:
+    """
+    Convert a file with the converter registered for its detected format.
+
+    Formats without a registered converter go through MarkItDown itself, with
+    the detected type as a hint so it does not have to guess.
+    """
+    from markitdown import StreamInfo
+
+    stream_info = StreamInfo(
+        extension=detected.spec.extension,
+        mimetype=detected.spec.mimetype,
+        charset=detected.charset,
+        local_path=file_path,
+    )
+
+    with open(file_path, "rb") as f:
+        converter = registry.get(detected.format)
+        if converter is None:
+            return md.convert_stream(f, stream_info=stream_info, **kwargs).text_content
+        return converter.convert(f, stream_info, **kwargs).text_content
@@ -0,0 +1,207 @@
+"""
+Markdown post-processing applied after conversion (and page marker injection).
+
+Long PDFs repeat running headers, footers, page numbers and legal boilerplate
+on every page; spreadsheets produce tables with no content. Removing them
+before chunking cuts chunk counts, embedding calls and vector storage.
+
+All passes are linear in the size of the document. Page markers
+(`<!-- Page N -->`) are never removed.
+"""
+
+import os
+import re
+from typing import Dict, List, Tuple
+
+MARKDOWN_CLEANUP_ENABLED = os.getenv("MARKDOWN_CLEANUP_ENABLED", "true").lower() == "true"
+# Minimum number of pages before repeated-line detection kicks in
+MARKDOWN_CLEANUP_MIN_PAGES = int(os.getenv("MARKDOWN_CLEANUP_MIN_PAGES", "3"))
+# Fraction of pages a line must appear on to be treated as a header/footer
+MARKDOWN_CLEANUP_REPEAT_RATIO = float(os.getenv("MARKDOWN_CLEANUP_REPEAT_RATIO", "0.8"))
+# Longer lines are content, not boilerplate
+MARKDOWN_CLEANUP_MAX_LINE_LENGTH = int(os.getenv("MARKDOWN_CLEANUP_MAX_LINE_LENGTH", "200"))
+# With real page breaks, only this many lines at the top/bottom of a page are candidates
+MARKDOWN_CLEANUP_EDGE_LINES = int(os.getenv("MARKDOWN_CLEANUP_EDGE_LINES", "3"))
+
+PAGE_MARKER_PATTERN = re.compile(r"<!-- Page \d+ -->")
+PAGE_NUMBER_PATTERN = re.compile(r"^[-–—\s]*(?:page\s*)?(\d+)(?:\s*(?:of|/)\s*\d+)?[-–—\s]*$", re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+LETTER_PATTERN = re.compile(r"[^\W\d_]")
+EMPTY_CELL_PATTERN = re.compile(r"^(|nan|none|unnamed: \d+|:?-+:?)$", re.IGNORECASE)
+
+
+def _fingerprint(line: str, page: int) -> str:
+    """
+    Normalize a line for comparison.
+
+    Numbers that look like page numbers ("7", "Page 7 of 40", "- 7 -") are keyed
+    by their offset from the page index, so a running page number compares equal
+    across pages while numeric data (table cells) does not.
+    """
+    normalized = WHITESPACE_PATTERN.sub(" ", line.strip().lower())
+    match = PAGE_NUMBER_PATTERN.match(normalized)
+    return f"<page-number{int(match.group(1)) - page:+d}>" if match else normalized
+
+
+def _split_pages(lines: List[str], has_page_breaks: bool) -> List[int]:
+    """Return the page index of every line, using form feeds if present, else page markers."""
+    page_of_line = []
+    page = 0
+    for line in lines:
+        if has_page_breaks:
+            if line == "\f":
+                page += 1
+        elif PAGE_MARKER_PATTERN.search(line):
+            page += 1
+        page_of_line.append(page)
+    return page_of_line
+
+
+def _is_candidate(line: str) -> bool:
+    stripped = line.strip()
+    return (
+        bool(stripped)
+        and len(stripped) <= MARKDOWN_CLEANUP_MAX_LINE_LENGTH
+        and not stripped.startswith("|")  # Table rows are handled separately
+        and not PAGE_MARKER_PATTERN.search(stripped)
+    )
+
+
+def remove_repeated_lines(lines: List[str]) -> Tuple[List[str], int]:
+    """
+    Drop lines that repeat across most pages (running headers, footers, page numbers).
+
+    pdfminer separates real pages with form feeds; when they are present only the
+    first/last few lines of each page are considered, which also catches bare page
+    numbers. A line only counts as repeated if it sits in the same zone (top or
+    bottom) on every page, and pages too short to have distinct zones are skipped,
+    so body text on short pages is never mistaken for a header. Otherwise pages are
+    approximated by the injected page markers and lines without any letters are
+    kept, since they are more likely to be data.
+    """
+    has_page_breaks = "\f" in lines
+    page_of_line = _split_pages(lines, has_page_breaks)
+    page_count = (page_of_line[-1] + 1) if page_of_line else 0
+
+    if page_count < MARKDOWN_CLEANUP_MIN_PAGES:
+        return lines, 0
+
+    candidate = [_is_candidate(line) for line in lines]
+
+    if has_page_breaks:
+        # Keep only the edge lines of each page as candidates, keyed by their zone
+        fingerprints = [""] * len(lines)
+        by_page: Dict[int, List[int]] = {}
+        for i, page in enumerate(page_of_line):
+            if candidate[i]:
+                by_page.setdefault(page, []).append(i)
+        for indices in by_page.values():
+            if len(indices) < 2 * MARKDOWN_CLEANUP_EDGE_LINES:
+                continue
+            for i in indices[:MARKDOWN_CLEANUP_EDGE_LINES]:
+                fingerprints[i] = "top:" + _fingerprint(lines[i], page_of_line[i])
+            for i in indices[-MARKDOWN_CLEANUP_EDGE_LINES:]:
+                fingerprints[i] = "bottom:" + _fingerprint(lines[i], page_of_line[i])
+    else:
+        fingerprints = [
+            _fingerprint(line, page) if c and LETTER_PATTERN.search(line) else ""
+            for c, line, page in zip(candidate, lines, page_of_line)
+        ]
+
+    # Count on how many distinct pages each fingerprint appears, in one pass
+    pages_seen: Dict[str, int] = {}
+    last_page: Dict[str, int] = {}
+    for fingerprint, page in zip(fingerprints, page_of_line):
+        if fingerprint and last_page.get(fingerprint) != page:
+            last_page[fingerprint] = page
+            pages_seen[fingerprint] = pages_seen.get(fingerprint, 0) + 1
+
+    min_pages = max(2, int(page_count * MARKDOWN_CLEANUP_REPEAT_RATIO))
+    repeated = {fingerprint for fingerprint, count in pages_seen.items() if count >= min_pages}
+
+    if not repeated:
+        return lines, 0
+
+    kept = [line for line, fingerprint in zip(lines, fingerprints) if fingerprint not in repeated]
+    return kept, len(lines) - len(kept)
+
+
+def _is_empty_row(line: str) -> bool:
+    cells = line.strip().strip("|").split("|")
+    return all(EMPTY_CELL_PATTERN.match(cell.strip()) for cell in cells)
+
+
+def collapse_empty_tables(lines: List[str]) -> Tuple[List[str], int]:
+    """Drop table rows with no content, and whole tables that have no content left."""
+    result: List[str] = []
+    removed = 0
+    table: List[str] = []
+
+    def flush():
+        nonlocal removed
+        if not table:
+            return
+        # Header row and separator, followed by the data rows
+        header, rows = table[:2], table[2:]
+        body = [row for row in rows if not _is_empty_row(row)]
+        if body:
+            result.extend(header + body)
+            removed += len(rows) - len(body)
+        elif rows or _is_empty_row(table[0]):
+            removed += len(table)
+        else:
+            result.extend(table)
+        table.clear()
+
+    for line in lines:
+        if line.lstrip().startswith("|"):
+            table.append(line)
+        else:
+            flush()
+            result.append(line)
+    flush()
+
+    return result, removed
+
+
+def normalize_whitespace(text: str) -> str:
+    """Strip trailing whitespace, drop page breaks and collapse runs of blank lines."""
+    lines = [line.replace("\xa0", " ").rstrip() for line in text.replace("\f", "\n").split("\n")]
+
+    result = []
+    blank_run = 0
+    for line in lines:
+        if line:
+            blank_run = 0
+            result.append(line)
+        else:
+            blank_run += 1
+            if blank_run == 1:
+                result.append(line)
+    return "\n".join(result).strip("\n")
+
+
+def clean_markdown(markdown_content: str) -> Tuple[str, Dict[str, int]]:
+    """
+    Run all post-processing passes over converted markdown.
+
+    Returns:
+        tuple[str, Dict[str, int]]: (cleaned_markdown, stats) where stats include chars_saved
+    """
+    original_length = len(markdown_content)
+    if not MARKDOWN_CLEANUP_ENABLED or not markdown_content:
+        return markdown_content, {"chars_saved": 0}
+
+    # Give pdfminer's page breaks their own line so they act as page boundaries
+    lines = markdown_content.replace("\f", "\n\f\n").split("\n")
+    lines, repeated_lines_removed = remove_repeated_lines(lines)
+    lines, table_rows_removed = collapse_empty_tables(lines)
+    cleaned = normalize_whitespace("\n".join(lines))
+
+    return cleaned, {
+        "original_length": original_length,
+        "cleaned_length": len(cleaned),
+        "chars_saved": original_length - len(cleaned),
+        "repeated_lines_removed": repeated_lines_removed,
+        "table_rows_removed": table_rows_removed,
+    }
@@ -0,0 +1,222 @@
+"""
+Offline bulk conversion CLI that pre-warms the conversion cache.
+
+Converts every file in a directory tree and/or every entry of a manifest
+(one local path or URL per line, `#` for comments) using the same
+conversion and caching code as the API, so that subsequent requests to
+/process-file and /process-url are served from cache.
+
+Examples:
+    python prewarm.py --dir /app/uploads --workers 4
+    python prewarm.py --manifest files.txt --journal prewarm.jsonl
+"""
+
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB, same limit as /process-file
+
+
+def is_url(source: str) -> bool:
+    return source.lower().startswith(("http://", "https://"))
+
+
+def collect_sources(directory: Optional[str], manifest: Optional[str], pattern: str) -> List[str]:
+    """Collect files from a directory tree and entries from a manifest, preserving order."""
+    sources: List[str] = []
+
+    if directory:
+        root = Path(directory)
+        if not root.is_dir():
+            raise SystemExit(f"❌ Not a directory: {directory}")
+        sources.extend(str(p.resolve()) for p in sorted(root.rglob(pattern)) if p.is_file())
+
+    if manifest:
+        with open(manifest, "r", encoding="utf-8") as f:
+            for line in f:
+                entry = line.strip()
+                if not entry or entry.startswith("#"):
+                    continue
+                sources.append(entry if is_url(entry) else str(Path(entry).resolve()))
+
+    # De-duplicate while keeping the original order
+    return list(dict.fromkeys(sources))
+
+
+def load_journal(journal_path: Optional[str]) -> set[str]:
+    """Return the sources that completed successfully in a previous run."""
+    completed: set[str] = set()
+    if not journal_path or not os.path.exists(journal_path):
+        return completed
+
+    with open(journal_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Partially written line from an interrupted run
+            if record.get("success"):
+                completed.add(record["source"])
+    return completed
+
+
+def _init_worker(verbose: bool) -> None:
+    # A terminal Ctrl-C reaches the whole process group; only the parent decides
+    # whether to stop, so in-flight conversions can finish and be journaled.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # The conversion code logs every step; keep the progress output readable.
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+
+
+def prewarm_source(source: str, force: bool) -> Dict[str, Any]:
+    """Convert a single file or URL into the cache. Runs inside a worker process."""
+    from utils import (
+        process_file_with_markitdown,
+        process_url_with_markitdown,
+        delete_cached_content,
+    )
+
+    start_time = time.time()
+    result: Dict[str, Any] = {"source": source, "success": False, "cached": False, "error_message": None}
+
+    try:
+        if is_url(source):
+            if force:
+                delete_cached_content(source)
+
+            markdown_content, processing_strategy, is_cached = process_url_with_markitdown(source)
+            result["success"] = processing_strategy is not None
+            result["cached"] = is_cached
+            result["processing_strategy"] = processing_strategy
+            result["content_length"] = len(markdown_content) if markdown_content else 0
+            if not result["success"]:
+                result["error_message"] = "Failed to process URL"
+        else:
+            if not os.path.exists(source):
+                result["error_message"] = "File not found"
+            elif os.path.getsize(source) > MAX_FILE_SIZE:
+                result["error_message"] = "File too large"
+            else:
+                markdown_content, is_cached = process_file_with_markitdown(source, use_cache=not force)
+                result["success"] = True
+                result["cached"] = is_cached
+                result["processing_strategy"] = "local_file"
+                result["content_length"] = len(markdown_content)
+    except Exception as e:
+        result["error_message"] = str(e)
+
+    result["processing_time"] = round(time.time() - start_time, 3)
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Pre-warm the conversion cache from a directory or manifest.")
+    parser.add_argument("--dir", dest="directory", help="Directory tree of files to convert")
+    parser.add_argument("--manifest", help="File with one local path or URL per line")
+    parser.add_argument("--pattern", default="*", help="Glob pattern for --dir (default: *)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parallel worker processes")
+    parser.add_argument("--journal", help="JSONL progress journal; completed entries are skipped on re-run")
+    parser.add_argument("--force", action="store_true", help="Re-convert even if a cache entry exists")
+    parser.add_argument("--verbose", action="store_true", help="Show conversion logs from workers")
+    args = parser.parse_args(argv)
+
+    if not args.directory and not args.manifest:
+        parser.error("at least one of --dir or --manifest is required")
+
+    sources = collect_sources(args.directory, args.manifest, args.pattern)
+    completed = set() if args.force else load_journal(args.journal)
+    pending = [s for s in sources if s not in completed]
+
+    print(f"📦 {len(sources)} sources found, {len(sources) - len(pending)} already done, {len(pending)} to process")
+    if not pending:
+        return 0
+
+    journal = open(args.journal, "a", encoding="utf-8") if args.journal else None
+    start_time = time.time()
+    counts = {"converted": 0, "cached": 0, "failed": 0}
+    recorded = set()
+
+    def record(future, source: str) -> None:
+        try:
+            result = future.result()
+        except BaseException as e:
+            # Worker crashed (e.g. killed by the OOM killer) or was interrupted
+            result = {"source": source, "success": False, "error_message": str(e) or type(e).__name__}
+
+        recorded.add(future)
+        done = len(recorded)
+        if not result["success"]:
+            counts["failed"] += 1
+            print(f"[{done}/{len(pending)}] ❌ {result['source']}: {result['error_message']}")
+        elif result.get("cached"):
+            counts["cached"] += 1
+            print(f"[{done}/{len(pending)}] 💾 {result['source']} (already cached)")
+        else:
+            counts["converted"] += 1
+            print(
+                f"[{done}/{len(pending)}] ✅ {result['source']} "
+                f"({result.get('content_length', 0):,} chars in {result['processing_time']:.2f}s)"
+            )
+
+        if journal:
+            journal.write(json.dumps({**result, "finished_at": time.time()}) + "\n")
+            journal.flush()
+
+    # Only a bounded window of work is handed to the pool, so an interrupt never
+    # has to wait for (or cancel) thousands of queued conversions
+    window = max(1, args.workers) * 2
+    queue = iter(pending)
+    in_flight: Dict[Any, str] = {}
+    interrupted = False
+
+    with ProcessPoolExecutor(
+        max_workers=max(1, args.workers), initializer=_init_worker, initargs=(args.verbose,)
+    ) as executor:
+        try:
+            while True:
+                while not interrupted and len(in_flight) < window:
+                    source = next(queue, None)
+                    if source is None:
+                        break
+                    in_flight[executor.submit(prewarm_source, source, args.force)] = source
+                if not in_flight:
+                    break
+
+                try:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                except KeyboardInterrupt:
+                    if interrupted:
+                        raise
+                    interrupted = True
+                    print(f"\n⏹️  Interrupted - finishing {len(in_flight)} in-flight conversions (Ctrl-C again to abort)")
+                    continue
+
+                for future in finished:
+                    record(future, in_flight.pop(future))
+        except KeyboardInterrupt:
+            # Second Ctrl-C: don't wait for the in-flight conversions either
+            executor.shutdown(wait=False, cancel_futures=True)
+        finally:
+            if journal:
+                journal.close()
+
+    if interrupted:
+        print(f"⏹️  Stopped after {len(recorded)}/{len(pending)} - re-run with the same --journal to resume")
+        return 130
+
+    converted, cached, failed = counts["converted"], counts["cached"], counts["failed"]
+    elapsed = time.time() - start_time
+    print(f"🏁 Done in {elapsed:.1f}s: {converted} converted, {cached} already cached, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
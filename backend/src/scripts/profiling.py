@@ -0,0 +1,274 @@
+"""
+On-demand profiling for slow conversions.
+
+Two modes are supported:
+- Per-request: the caller sets `profile: true` and the whole conversion runs
+  under cProfile (plus tracemalloc when PROFILE_TRACE_ALLOCATIONS is set).
+  The result is a `.prof` file that can be opened with pstats or snakeviz.
+- Threshold: when PROFILE_THRESHOLD_SECONDS > 0, a background sampler starts
+  inspecting the converting thread's stack once a conversion has been running
+  for that long. The result is a collapsed-stack `.txt` file that can be fed
+  to flamegraph.pl or speedscope.
+
+Each profile is stored in PROFILE_DIR next to a JSON metadata file holding the
+file type, page count and stage timings.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+PROFILE_THRESHOLD_SECONDS = float(os.getenv("PROFILE_THRESHOLD_SECONDS", "0"))  # 0 disables sampling
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.01"))
+PROFILE_TRACE_ALLOCATIONS = os.getenv("PROFILE_TRACE_ALLOCATIONS", "false").lower() == "true"
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+
+PROFILE_ID_PATTERN = re.compile(r"^[0-9]+-[0-9a-f]{8}$")
+
+_active = threading.local()
+
+
+class _StackSampler(threading.Thread):
+    """Samples another thread's stack at a fixed interval after an initial delay."""
+
+    def __init__(self, thread_id: int, delay: float, interval: float):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.delay = delay
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        # Fast conversions finish before the delay expires and are never sampled
+        if self._stop_event.wait(self.delay):
+            return
+
+        while not self._stop_event.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[_collapse_stack(frame)] += 1
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _collapse_stack(frame) -> str:
+    """Render a frame chain in the collapsed `outer;inner` format used by flame graphs."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{Path(code.co_filename).name}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class ConversionProfiler:
+    """
+    Context manager wrapping a single conversion.
+
+    Usage:
+        with ConversionProfiler(file_path, enabled=request.profile) as profiler:
+            ...
+        profiler.profile_id  # set when a profile was stored
+    """
+
+    def __init__(self, source: str, enabled: bool = False):
+        self.source = source
+        self.enabled = enabled
+        self.metadata: Dict[str, Any] = {}
+        self.stage_timings: Dict[str, float] = {}
+        self.profile_id: Optional[str] = None
+        self._profile: Optional[cProfile.Profile] = None
+        self._sampler: Optional[_StackSampler] = None
+        self._traced_allocations = False
+        self._start_time = 0.0
+
+    def __enter__(self) -> "ConversionProfiler":
+        self._start_time = time.time()
+        _active.profiler = self
+
+        if self.enabled:
+            if PROFILE_TRACE_ALLOCATIONS and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._traced_allocations = True
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif PROFILE_THRESHOLD_SECONDS > 0:
+            self._sampler = _StackSampler(
+                threading.get_ident(), PROFILE_THRESHOLD_SECONDS, PROFILE_SAMPLE_INTERVAL
+            )
+            self._sampler.start()
+
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.time() - self._start_time
+        _active.profiler = None
+
+        if self._profile is not None:
+            self._profile.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+
+        allocations = None
+        if self._traced_allocations:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            allocations = {
+                "peak_bytes": peak,
+                "top": [
+                    {"location": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+                    for stat in snapshot.statistics("lineno")[:25]
+                ],
+            }
+
+        try:
+            if self._profile is not None:
+                self._save(duration, "cprofile", allocations, error=exc)
+            elif self._sampler is not None and self._sampler.stacks:
+                self._save(duration, "sampled", allocations, error=exc)
+        except Exception as e:
+            # Profiling must never break the conversion itself
+            print(f"⚠️ Could not save profile for {self.source}: {e}")
+
+        return False
+
+    def annotate(self, **metadata):
+        self.metadata.update({k: v for k, v in metadata.items() if v is not None})
+
+    @contextmanager
+    def stage(self, name: str):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.stage_timings[name] = round(self.stage_timings.get(name, 0.0) + time.time() - start_time, 4)
+
+    def _save(self, duration: float, mode: str, allocations: Optional[Dict[str, Any]], error=None):
+        PROFILE_DIR.mkdir(exist_ok=True)
+        self.profile_id = f"{int(self._start_time)}-{uuid.uuid4().hex[:8]}"
+
+        if mode == "cprofile":
+            artifact = PROFILE_DIR / f"{self.profile_id}.prof"
+            self._profile.dump_stats(str(artifact))
+            stats = pstats.Stats(str(artifact)).sort_stats("cumulative")
+            top_functions = [
+                {
+                    "function": f"{Path(filename).name}:{line}({func})",
+                    "calls": calls,
+                    "tottime": round(tottime, 4),
+                    "cumtime": round(cumtime, 4),
+                }
+                for (filename, line, func), (_, calls, tottime, cumtime, _) in sorted(
+                    stats.stats.items(), key=lambda item: item[1][3], reverse=True
+                )[:20]
+            ]
+        else:
+            artifact = PROFILE_DIR / f"{self.profile_id}.txt"
+            with open(artifact, "w", encoding="utf-8") as f:
+                for stack, count in self._sampler.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            top_functions = None
+
+        metadata = {
+            "profile_id": self.profile_id,
+            "source": self.source,
+            "mode": mode,
+            "started_at": self._start_time,
+            "duration": round(duration, 3),
+            "file_type": Path(self.source.split("?", 1)[0]).suffix.lstrip(".").lower() or None,
+            **self.metadata,
+            "stage_timings": self.stage_timings,
+            "artifact": artifact.name,
+            "top_functions": top_functions,
+            "allocations": allocations,
+            "error": str(error) if error else None,
+        }
+        if mode == "sampled":
+            metadata["sample_interval"] = PROFILE_SAMPLE_INTERVAL
+            metadata["sample_count"] = sum(self._sampler.stacks.values())
+
+        with open(PROFILE_DIR / f"{self.profile_id}.json", "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=2)
+
+        print(f"🔬 Stored {mode} profile {self.profile_id} ({duration:.2f}s) for {self.source}")
+        prune_profiles()
+
+
+def current_profiler() -> Optional[ConversionProfiler]:
+    return getattr(_active, "profiler", None)
+
+
+@contextmanager
+def profile_stage(name: str):
+    """Time a stage of the active conversion; a no-op when nothing is being profiled."""
+    profiler = current_profiler()
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
+
+
+def annotate_profile(**metadata):
+    """Attach metadata (e.g. page_count) to the active conversion's profile, if any."""
+    profiler = current_profiler()
+    if profiler is not None:
+        profiler.annotate(**metadata)
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Return stored profile metadata, newest first (without the bulky sections)."""
+    profiles = []
+    for metadata_file in PROFILE_DIR.glob("*.json"):
+        try:
+            with open(metadata_file, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            continue
+        metadata.pop("top_functions", None)
+        metadata.pop("allocations", None)
+        profiles.append(metadata)
+    return sorted(profiles, key=lambda p: p.get("started_at", 0), reverse=True)
+
+
+def get_profile(profile_id: str) -> Optional[Dict[str, Any]]:
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    metadata_file = PROFILE_DIR / f"{profile_id}.json"
+    if not metadata_file.exists():
+        return None
+    with open(metadata_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_profile_artifact(profile_id: str) -> Optional[Path]:
+    metadata = get_profile(profile_id)
+    if metadata is None:
+        return None
+    artifact = PROFILE_DIR / metadata["artifact"]
+    return artifact if artifact.exists() else None
+
+
+def prune_profiles() -> None:
+    """Keep only the newest PROFILE_MAX_FILES profiles."""
+    metadata_files = sorted(PROFILE_DIR.glob("*.json"), key=lambda f: f.stat().st_mtime, reverse=True)
+    for metadata_file in metadata_files[PROFILE_MAX_FILES:]:
+        for path in PROFILE_DIR.glob(f"{metadata_file.stem}.*"):
+            path.unlink(missing_ok=True)
@@ -0,0 +1,108 @@
+import fnmatch
+import time
+
+from cache import DirectoryBackend, RedisBackend, TieredCache
+
+
+class FakeRedis:
+    """In-memory stand-in for the subset of redis-py used by RedisBackend."""
+
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value, ex=None):
+        self.store[key] = value
+
+    def delete(self, key):
+        return 1 if self.store.pop(key, None) is not None else 0
+
+    def scan_iter(self, match="*"):
+        return [key for key in list(self.store) if fnmatch.fnmatch(key, match)]
+
+
+def make_replicas(tmp_path):
+    shared = FakeRedis()
+    replica_a = TieredCache(DirectoryBackend(tmp_path / "a"), RedisBackend(shared))
+    replica_b = TieredCache(DirectoryBackend(tmp_path / "b"), RedisBackend(shared))
+    return shared, replica_a, replica_b
+
+
+def test_read_through_and_promotion(tmp_path):
+    shared, replica_a, replica_b = make_replicas(tmp_path)
+    entry = {"markdown_content": "# Doc", "processing_strategy": "batch_text"}
+
+    replica_a.set("key", entry)
+    # Stored compressed in the shared tier
+    assert shared.store["rag-parsing:cache:key"][:1] != b"{"
+
+    assert replica_b.get("key") == entry
+    assert replica_b.stats()["tiers"]["l2"]["hits"] == 1
+
+    # Promoted into replica B's L1, so the next read does not touch L2
+    assert replica_b.l1.get("key") is not None
+    assert replica_b.get("key") == entry
+    assert replica_b.stats()["tiers"]["l1"]["hits"] == 1
+    assert replica_b.stats()["tiers"]["l2"]["hits"] == 1
+
+
+def test_clear_across_replicas(tmp_path):
+    shared, replica_a, replica_b = make_replicas(tmp_path)
+    replica_a.set("key", {"markdown_content": "a"})
+    replica_b.get("key")
+
+    assert replica_a.clear(include_shared=False) == {"l1": 1}
+    assert replica_b.get("key") is not None
+
+    assert replica_b.clear() == {"l1": 1, "l2": 1}
+    assert not shared.store
+    assert replica_a.get("key") is None
+
+
+def test_stale_l1_prefers_fresher_l2(tmp_path):
+    _, replica_a, replica_b = make_replicas(tmp_path)
+    now = time.time()
+    replica_a.set("key", {"markdown_content": "old", "validated_at": now - 7200})
+    replica_b.get("key")
+
+    # Replica A revalidates; replica B's L1 copy is now out of date
+    replica_a.set("key", {"markdown_content": "new", "validated_at": now})
+
+    def is_stale(cache_data):
+        return now - cache_data["validated_at"] > 3600
+
+    assert replica_b.get("key")["markdown_content"] == "old"
+    assert replica_b.get("key", is_stale=is_stale)["markdown_content"] == "new"
+    assert replica_b.get("key")["markdown_content"] == "new"
+
+
+def test_stale_l1_kept_when_l2_is_stale_too(tmp_path):
+    shared, replica_a, _ = make_replicas(tmp_path)
+    replica_a.set("key", {"markdown_content": "local", "validated_at": 0})
+    shared.store.clear()
+
+    assert replica_a.get("key", is_stale=lambda cache_data: True)["markdown_content"] == "local"
+
+
+def test_one_outcome_per_lookup(tmp_path):
+    _, replica_a, replica_b = make_replicas(tmp_path)
+    replica_a.set("key", {"markdown_content": "old", "validated_at": 0})
+    replica_b.get("key")
+    replica_a.set("key", {"markdown_content": "new", "validated_at": time.time()})
+
+    def is_stale(cache_data):
+        return cache_data["validated_at"] == 0
+
+    # Stale in L1, served from L2: one lookup, one hit
+    assert replica_b.get("key", is_stale=is_stale)["markdown_content"] == "new"
+    assert replica_b.get("missing") is None
+
+    stats = replica_b.stats()
+    assert stats["lookups"] == 3
+    assert stats["hit_ratio"] == round(2 / 3, 4)
+    assert stats["tiers"]["l1"]["hits"] == 0
+    assert stats["tiers"]["l1"]["misses"] == 3
+    assert stats["tiers"]["l2"]["hits"] == 2
+    assert stats["tiers"]["l2"]["misses"] == 1
@@ -0,0 +1,90 @@
+import json
+import zipfile
+
+import pytest
+
+from formats import UnsupportedFormatError, detect_format
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.mark.parametrize("encoding", ["utf-16", "utf-16-be", "utf-32", "utf-8-sig"])
+def test_text_with_bom(tmp_path, encoding):
+    data = "Plain text\nwith a byte order mark\n".encode(encoding)
+    if encoding == "utf-16-be":
+        data = b"\xfe\xff" + data
+
+    detected = detect_format(write(tmp_path, "upload.tmp", data))
+
+    assert detected.format == "text"
+    assert detected.charset is not None
+
+
+def test_binary_still_rejected(tmp_path):
+    with pytest.raises(UnsupportedFormatError):
+        detect_format(write(tmp_path, "blob.bin", b"\x01\x02\x00\x03" * 10))
+
+
+def test_epub(tmp_path):
+    path = tmp_path / "book.tmp"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("mimetype", "application/epub+zip")
+        archive.writestr("META-INF/container.xml", "<container/>")
+
+    assert detect_format(str(path)).format == "epub"
+
+
+def test_plain_zip_rejected(tmp_path):
+    path = tmp_path / "archive.tmp"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("notes.txt", "hello")
+
+    with pytest.raises(UnsupportedFormatError):
+        detect_format(str(path))
+
+
+def test_ipynb(tmp_path):
+    notebook = json.dumps({"cells": [], "metadata": {}, "nbformat": 4, "nbformat_minor": 5}, indent=1)
+
+    assert detect_format(write(tmp_path, "nb.tmp", notebook.encode())).format == "ipynb"
+    assert detect_format(write(tmp_path, "data.tmp", b'{"a": 1}')).format == "json"
+
+
+def test_feeds_and_xml(tmp_path):
+    rss = b'<?xml version="1.0"?>\n<rss version="2.0"><channel><title>t</title></channel></rss>'
+    atom = b'<?xml version="1.0"?>\n<feed xmlns="http://www.w3.org/2005/Atom"></feed>'
+    xml = b'<?xml version="1.0"?>\n<catalog><book id="1"/></catalog>'
+
+    assert detect_format(write(tmp_path, "rss.tmp", rss)).format == "rss"
+    assert detect_format(write(tmp_path, "atom.tmp", atom)).format == "rss"
+    assert detect_format(write(tmp_path, "data.tmp", xml)).format == "xml"
+
+
+@pytest.mark.parametrize(
+    "content_type, data, expected",
+    [
+        ("text/csv; charset=utf-8", b"id,name\n1,Alice\n2,Bob\n", "csv"),
+        ("text/html", b"<p>Fragment without an html tag</p>", "html"),
+        ("application/xml", b"<catalog><book id='1'/></catalog>", "xml"),
+        ("application/vnd.api+json", b"  \n{\"a\": 1}", "json"),
+        ("text/plain", b"id,name\n1,Alice\n", "text"),
+        (None, b"id,name\n1,Alice\n", "text"),
+    ],
+)
+def test_content_type_hint_for_extensionless_downloads(tmp_path, content_type, data, expected):
+    path = write(tmp_path, "download.tmp", data)
+
+    detected = detect_format(path, filename_hint="https://example.com/export?id=5", content_type=content_type)
+
+    assert detected.format == expected
+
+
+def test_extension_and_content_win_over_content_type(tmp_path):
+    rss = b'<?xml version="1.0"?>\n<rss version="2.0"></rss>'
+
+    assert detect_format(write(tmp_path, "a.tmp", b"a,b\n"), "data.json", content_type="text/csv").format == "json"
+    assert detect_format(write(tmp_path, "b.tmp", rss), content_type="application/xml").format == "rss"
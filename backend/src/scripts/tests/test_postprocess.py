@@ -0,0 +1,78 @@
+from postprocess import clean_markdown
+
+
+def test_short_pages_keep_repeated_body_lines():
+    markdown = "\f".join(f"Summary\nItem {i}\nTotal: 5" for i in range(6))
+
+    cleaned, stats = clean_markdown(markdown)
+
+    assert stats["repeated_lines_removed"] == 0
+    assert cleaned.count("Summary") == 6
+    assert cleaned.count("Total: 5") == 6
+
+
+def test_running_header_and_footer_removed():
+    pages = [
+        "\n".join(
+            [
+                "ACME Corp Annual Report",
+                f"Section {i}",
+                f"Intro paragraph {i}",
+                "Summary",
+                f"Detail {i}",
+                f"Closing line {i}",
+                f"Page {i + 1} of 6",
+            ]
+        )
+        for i in range(6)
+    ]
+
+    cleaned, stats = clean_markdown("\f".join(pages))
+
+    assert "ACME Corp Annual Report" not in cleaned
+    assert "of 6" not in cleaned
+    assert cleaned.count("Summary") == 6
+    assert stats["repeated_lines_removed"] == 12
+
+
+def test_line_must_repeat_in_the_same_zone():
+    pages = []
+    for i in range(6):
+        body = [f"Heading {i}", f"First {i}", f"Second {i}", f"Third {i}", f"Fourth {i}", f"Last {i}"]
+        pages.append("\n".join(["Confidential"] + body if i < 3 else body + ["Confidential"]))
+
+    cleaned, stats = clean_markdown("\f".join(pages))
+
+    assert stats["repeated_lines_removed"] == 0
+    assert cleaned.count("Confidential") == 6
+
+
+def test_numeric_edge_lines_are_data_not_page_numbers():
+    pages = [
+        "\n".join(
+            [f"Quarter {i} results", f"Revenue by region {i}", f"Notes {i}", "North", "South", "West"]
+            + [str(1200 + i), str(800 + 2 * i), str(400 - i)]
+            + ([str(i + 1)] if i % 2 else [])
+        )
+        for i in range(10)
+    ]
+
+    cleaned, _ = clean_markdown("\f".join(pages))
+
+    for i in range(10):
+        assert str(1200 + i) in cleaned.split("\n")
+        assert str(800 + 2 * i) in cleaned.split("\n")
+        assert str(400 - i) in cleaned.split("\n")
+
+
+def test_sequential_page_numbers_removed():
+    pages = [
+        "\n".join([f"Heading {i}", f"First {i}", f"Second {i}", f"Third {i}", f"Fourth {i}", "1200", f"- {i + 1} -"])
+        for i in range(6)
+    ]
+
+    cleaned, stats = clean_markdown("\f".join(pages))
+
+    assert "- 1 -" not in cleaned and "- 6 -" not in cleaned
+    assert cleaned.count("1200") == 6
+    assert stats["repeated_lines_removed"] == 6
@@ -3,7 +3,6 @@ from dotenv import load_dotenv
 import time
 import os
 import hashlib
-import json
 import requests
 import tempfile
 from pathlib import Path
@@ -12,6 +11,10 @@ import PyPDF2
 import re
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 import google.generativeai as genai
+from profiling import profile_stage, annotate_profile
+from cache import TieredCache, DirectoryBackend, create_l2_backend_from_env
+from postprocess import clean_markdown
+from formats import DetectedFormat, UnsupportedFormatError, detect_format, build_converter_registry, convert_detected
 
 load_dotenv(override=True)
 
@@ -77,14 +80,25 @@ if gemini_api_key:
     genai.configure(api_key=gemini_api_key)
     gemini_client = GeminiClientWrapper()
     md = MarkItDown(llm_client=gemini_client, llm_model="gemini-2.5-flash")
+    converter_kwargs = {"llm_client": gemini_client, "llm_model": "gemini-2.5-flash"}
 else:
     md = MarkItDown()
+    converter_kwargs = {}
     print("⚠️ MarkItDown initialized without LLM (no GOOGLE_GENAI_API_KEY found)")
 
-# Cache directory
-CACHE_DIR = Path("url_cache")
-CACHE_DIR.mkdir(exist_ok=True)
+# One pre-initialized converter per sniffed format, see formats.py
+converter_registry = build_converter_registry()
+
+# Cache directory (local L1) and optional shared L2, see cache.py
+CACHE_DIR = Path(os.getenv("CACHE_DIR", "url_cache"))
+conversion_cache = TieredCache(
+    DirectoryBackend(CACHE_DIR),
+    create_l2_backend_from_env(),
+    l2_compression=os.getenv("CACHE_L2_COMPRESSION", "true").lower() == "true",
+)
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB in bytes
+# Seconds a cached URL is served before it is revalidated with a conditional GET (-1 = never)
+URL_CACHE_MAX_AGE = int(os.getenv("URL_CACHE_MAX_AGE", "3600"))
 
 
 
@@ -95,7 +109,7 @@ def inject_page_markers_into_markdown(markdown_content: str, file_path: str, pag
     Inject page markers into PDF markdown content using proportional distribution.
     More efficient approach that doesn't re-extract PDF text.
     """
-    if not file_path.lower().endswith('.pdf'):
+    if page_count is None and not file_path.lower().endswith('.pdf'):
         print(f"⚠️ Not a PDF file (extension check): {file_path}")
         return markdown_content
     
@@ -147,31 +161,19 @@ def get_pdf_page_count(file_path: str) -> Optional[int]:
         return None
 
 
-def determine_processing_strategy(url: str, temp_file_path: str, headers: dict) -> str:
+def determine_processing_strategy(detected: DetectedFormat) -> str:
     """
     Determine processing strategy based on file type and characteristics.
 
     Args:
-        url: The original URL
-        temp_file_path: Path to the downloaded temporary file
-        headers: HTTP headers from the request
+        detected: Format sniffed from the downloaded file's content
 
     Returns:
         'batch_pdf', 'batch_text', or 'rag'
     """
-    # Check if it's a PDF file
-    content_type = headers.get("content-type", "").lower()
-    url_lower = url.lower()
-
-    is_pdf = (
-        "pdf" in content_type
-        or "application/pdf" in content_type
-        or url_lower.endswith(".pdf")
-        or ".pdf?" in url_lower
-    )
-
-    if is_pdf:
-        page_count = get_pdf_page_count(temp_file_path)
+    if detected.format == "pdf":
+        page_count = detected.page_count
+        annotate_profile(page_count=page_count)
         if page_count is not None:
             if page_count < 200:
                 print(
@@ -188,7 +190,7 @@ def determine_processing_strategy(url: str, temp_file_path: str, headers: dict)
             return "batch_pdf"
     else:
         print(
-            "Non-PDF file detected → batch_text processing (with markdown generation)"
+            f"{detected.format.upper()} file detected → batch_text processing (with markdown generation)"
         )
         return "batch_text"
 
@@ -198,46 +200,116 @@ def get_cache_key(url: str) -> str:
     return hashlib.md5(url.encode()).hexdigest()
 
 
-def get_cached_content(url: str) -> tuple[Optional[str], Optional[str]]:
-    """Check if URL content is already cached and return it with processing strategy."""
-    cache_key = get_cache_key(url)
-    cache_file = CACHE_DIR / f"{cache_key}.json"
+def hash_file(file_path: str) -> str:
+    """Compute the SHA-256 digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    if cache_file.exists():
-        try:
-            with open(cache_file, "r", encoding="utf-8") as f:
-                cache_data = json.load(f)
-                markdown_content = cache_data.get("markdown_content")
-                processing_strategy = cache_data.get(
-                    "processing_strategy", "batch_text"
-                )  # Default fallback
 
-                # For batch_pdf, content is stored as empty string, convert to None
-                if processing_strategy == "batch_pdf" and markdown_content == "":
-                    markdown_content = None
+def get_file_cache_id(file_path: str) -> str:
+    """
+    Build the cache identifier for a local file.
+
+    Files are keyed by content rather than path so that the same document is
+    only converted once, regardless of where it was uploaded or pre-warmed from.
+    """
+    return f"file-sha256:{hash_file(file_path)}"
+
+
+def get_cache_entry(url: str) -> Optional[Dict[str, Any]]:
+    """Load the raw cache entry for a URL or cache identifier."""
+    if url.startswith("file-sha256:"):
+        # Content-addressed entries never go stale
+        return conversion_cache.get(get_cache_key(url))
+    return conversion_cache.get(get_cache_key(url), is_stale=lambda cache_data: not is_cache_entry_fresh(cache_data))
+
+
+def is_cache_entry_fresh(cache_data: Dict[str, Any]) -> bool:
+    """
+    Check whether a cached URL entry can be served without revalidation.
+
+    Entries are fresh for URL_CACHE_MAX_AGE seconds after they were last
+    fetched or revalidated. A negative max age disables revalidation entirely.
+    """
+    if URL_CACHE_MAX_AGE < 0:
+        return True
+
+    validated_at = cache_data.get("validated_at", cache_data.get("cached_at", 0))
+    return time.time() - validated_at < URL_CACHE_MAX_AGE
 
-                return markdown_content, processing_strategy
-        except (json.JSONDecodeError, KeyError):
-            # If cache file is corrupted, remove it
-            cache_file.unlink()
 
-    return None, None
+def _entry_to_content(cache_data: Dict[str, Any]) -> tuple[Optional[str], Optional[str]]:
+    markdown_content = cache_data.get("markdown_content")
+    processing_strategy = cache_data.get(
+        "processing_strategy", "batch_text"
+    )  # Default fallback
 
+    # For batch_pdf, content is stored as empty string, convert to None
+    if processing_strategy == "batch_pdf" and markdown_content == "":
+        markdown_content = None
 
-def save_to_cache(url: str, markdown_content: str, processing_strategy: str) -> None:
-    """Save markdown content and processing strategy to cache."""
-    cache_key = get_cache_key(url)
-    cache_file = CACHE_DIR / f"{cache_key}.json"
+    return markdown_content, processing_strategy
 
+
+def get_cached_content(url: str, require_fresh: bool = False) -> tuple[Optional[str], Optional[str]]:
+    """
+    Check if URL content is already cached and return it with processing strategy.
+
+    With require_fresh, entries that are due for revalidation are treated as misses.
+    """
+    cache_data = get_cache_entry(url)
+    if cache_data is None:
+        return None, None
+
+    if require_fresh and not is_cache_entry_fresh(cache_data):
+        return None, None
+
+    return _entry_to_content(cache_data)
+
+
+def extract_validators(headers) -> Dict[str, str]:
+    """Pick the HTTP cache validators (ETag, Last-Modified) out of response headers."""
+    lowered = {k.lower(): v for k, v in headers.items()}
+    validators = {}
+    if lowered.get("etag"):
+        validators["etag"] = lowered["etag"]
+    if lowered.get("last-modified"):
+        validators["last_modified"] = lowered["last-modified"]
+    return validators
+
+
+def save_to_cache(
+    url: str,
+    markdown_content: str,
+    processing_strategy: str,
+    validators: Optional[Dict[str, str]] = None,
+) -> None:
+    """Save markdown content, processing strategy and revalidation metadata to cache."""
+    now = time.time()
     cache_data = {
         "url": url,
         "markdown_content": markdown_content,
         "processing_strategy": processing_strategy,
-        "cached_at": time.time(),
+        "cached_at": now,
+        "validated_at": now,
+        **(validators or {}),
     }
 
-    with open(cache_file, "w", encoding="utf-8") as f:
-        json.dump(cache_data, f, indent=2)
+    conversion_cache.set(get_cache_key(url), cache_data)
+
+
+def touch_cache_entry(url: str, cache_data: Dict[str, Any], validators: Optional[Dict[str, str]] = None) -> None:
+    """Mark a cache entry as revalidated, refreshing any validators the server sent."""
+    cache_data = {**cache_data, **(validators or {}), "validated_at": time.time()}
+    conversion_cache.set(get_cache_key(url), cache_data)
+
+
+def delete_cached_content(url: str) -> None:
+    """Remove the cache entry for a URL or cache identifier, if any."""
+    conversion_cache.delete(get_cache_key(url))
 
 
 def format_file_size(size_bytes: int) -> str:
@@ -311,18 +383,16 @@ def download_file_direct(url: str) -> Optional[str]:
         return None
 
 
-def download_with_size_limit(url: str) -> Optional[str]:
-    """Download file from URL with size limit checking (fallback for unknown sizes)."""
-    print(f"⬇️  Streaming download with size monitoring for: {url}")
-
-    try:
-        response = requests.get(url, stream=True, timeout=30)
-        response.raise_for_status()
+def write_response_to_temp_file(response: requests.Response) -> Optional[str]:
+    """
+    Stream a response body to a temporary file, enforcing the size limit.
 
-        # Create a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".tmp") as temp_file:
-            downloaded_size = 0
+    The partial file is removed if the stream fails; the error is re-raised.
+    """
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".tmp") as temp_file:
+        downloaded_size = 0
 
+        try:
             for chunk in response.iter_content(chunk_size=8192):
                 if chunk:
                     downloaded_size += len(chunk)
@@ -337,105 +407,289 @@ def download_with_size_limit(url: str) -> Optional[str]:
                         return None
 
                     temp_file.write(chunk)
+        except Exception:
+            temp_file.close()
+            os.unlink(temp_file.name)
+            raise
 
-            temp_file.flush()
-            print(f"✅ Streamed download complete: {format_file_size(downloaded_size)}")
-            return temp_file.name
+        temp_file.flush()
+        print(f"✅ Streamed download complete: {format_file_size(downloaded_size)}")
+        return temp_file.name
+
+
+def download_with_size_limit(url: str) -> Optional[str]:
+    """Download file from URL with size limit checking (fallback for unknown sizes)."""
+    print(f"⬇️  Streaming download with size monitoring for: {url}")
+
+    try:
+        response = requests.get(url, stream=True, timeout=30)
+        response.raise_for_status()
+        return write_response_to_temp_file(response)
 
     except requests.RequestException as e:
         print(f"❌ Error during streaming download: {e}")
         return None
 
 
-def process_url_with_markitdown(url: str) -> tuple[Optional[str], Optional[str]]:
+def conditional_get(url: str, cache_data: Dict[str, Any]) -> Optional[requests.Response]:
+    """
+    Revalidate a cached URL with a conditional GET.
+
+    Sends If-None-Match / If-Modified-Since from the stored validators. The
+    response is streamed, so a 304 costs a single round trip and a 200 can be
+    written straight to disk without a separate HEAD request.
+
+    Returns None when the origin is unavailable (connection error or 5xx);
+    4xx responses are returned for the caller to handle.
+    """
+    conditional_headers = {}
+    if cache_data.get("etag"):
+        conditional_headers["If-None-Match"] = cache_data["etag"]
+    if cache_data.get("last_modified"):
+        conditional_headers["If-Modified-Since"] = cache_data["last_modified"]
+
+    print(f"🔁 Revalidating cached URL ({', '.join(conditional_headers) or 'no validators'})")
+
+    try:
+        response = requests.get(url, headers=conditional_headers, stream=True, timeout=30)
+        if response.status_code >= 500:
+            response.close()
+            print(f"❌ Origin error while revalidating URL: HTTP {response.status_code}")
+            return None
+        return response
+    except requests.RequestException as e:
+        print(f"❌ Error revalidating URL: {e}")
+        return None
+
+
+def postprocess_markdown(markdown_content: str) -> str:
+    """Strip repeated headers/footers and boilerplate, see postprocess.py."""
+    with profile_stage("postprocess"):
+        cleaned_content, stats = clean_markdown(markdown_content)
+    annotate_profile(postprocess_chars_saved=stats["chars_saved"])
+
+    if stats["chars_saved"]:
+        print(
+            f"🧽 Post-processing saved {stats['chars_saved']:,} chars "
+            f"({stats['repeated_lines_removed']} repeated lines, {stats['table_rows_removed']} empty table rows)"
+        )
+    return cleaned_content
+
+
+def convert_file_to_markdown(file_path: str) -> str:
+    """
+    Convert a local file with the converter for its sniffed format, injecting
+    page markers for PDFs and post-processing the result.
+
+    Raises UnsupportedFormatError for unsupported, encrypted or over-limit files.
+    """
+    with profile_stage("detect"):
+        detected = detect_format(file_path)
+    annotate_profile(file_type=detected.format, page_count=detected.page_count)
+    print(f"🔎 Detected format: {detected.format} ({format_file_size(detected.size)})")
+
+    with profile_stage("convert"):
+        markdown_content = convert_detected(md, converter_registry, file_path, detected, **converter_kwargs)
+
+    if detected.format == "pdf":
+        page_count = detected.page_count
+        print(f"📄 PDF detected: {page_count} pages")
+
+        if page_count and page_count > 0:
+            before_length = len(markdown_content)
+            with profile_stage("page_markers"):
+                markdown_content = inject_page_markers_into_markdown(markdown_content, file_path, page_count)
+            after_length = len(markdown_content)
+            marker_count = markdown_content.count('<!-- Page')
+            print(f"✓ Page marker injection: {before_length} → {after_length} chars, {marker_count} markers added")
+        else:
+            print(f"⚠️ Could not get page count, skipping page markers")
+
+    return postprocess_markdown(markdown_content)
+
+
+def process_file_with_markitdown(file_path: str, use_cache: bool = True) -> tuple[str, bool]:
+    """
+    Process a local file with MarkItDown, checking the content-addressed cache first.
+
+    Args:
+        file_path (str): Path to the file on the filesystem
+        use_cache (bool): Whether to serve an existing cache entry
+
+    Returns:
+        tuple[str, bool]: (markdown_content, cached)
+
+    Conversion errors (including GEMINI_* errors) are propagated to the caller.
+    """
+    with profile_stage("hash"):
+        cache_id = get_file_cache_id(file_path)
+
+    if use_cache:
+        with profile_stage("cache_lookup"):
+            cached_content, cached_strategy = get_cached_content(cache_id)
+        if cached_strategy is not None and cached_content:
+            print(f"💾 Found cached content for {file_path} - returning immediately")
+            return cached_content, True
+
+    print(f"🔄 Processing file: {file_path}")
+    markdown_content = convert_file_to_markdown(file_path)
+
+    print("💾 Saving to cache...")
+    with profile_stage("cache_write"):
+        save_to_cache(cache_id, markdown_content, "local_file")
+    return markdown_content, False
+
+
+def process_url_with_markitdown(url: str) -> tuple[Optional[str], Optional[str], bool]:
     """
     Process a URL with MarkItDown, checking cache first and respecting size limits.
     Optimized for blob URLs with HEAD request size checking.
 
+    Cached entries older than URL_CACHE_MAX_AGE are revalidated with a
+    conditional GET: a 304 (or an unchanged content hash) keeps the cached
+    conversion, a 404/410 drops it, and any other successful response is
+    downloaded and converted again. Stale content is only served when the
+    origin is unreachable or returns a 5xx.
+
     Args:
         url (str): The URL to process
 
     Returns:
-        tuple[Optional[str], Optional[str]]: (markdown_content, processing_strategy) or (None, None) if processing fails
+        tuple[Optional[str], Optional[str], bool]: (markdown_content, processing_strategy, cached)
+        or (None, None, False) if processing fails
     """
     print(f"\n🚀 Starting processing for URL: {url}")
 
     # Check for .zip files and reject them
     if url.lower().endswith(".zip") or ".zip?" in url.lower():
         print("🚫 ZIP files are not supported - returning None")
-        return None, None
+        return None, None, False
 
     # Check cache first
-    cached_content, cached_strategy = get_cached_content(url)
-    if (
-        cached_strategy is not None
-    ):  # We have a cached result (content might be None for batch_pdf)
+    cache_data = get_cache_entry(url)
+    if cache_data is not None and is_cache_entry_fresh(cache_data):
+        # We have a fresh cached result (content might be None for batch_pdf)
         print("💾 Found cached content - returning immediately")
-        return cached_content, cached_strategy
-
-    print("🆕 No cache found - processing new URL")
-
-    # Get file info using HEAD request
-    file_size, headers = get_file_info(url)
-
-    # Check content-type for zip files as additional safety
-    content_type = headers.get("content-type", "").lower()
-    if "zip" in content_type or "application/zip" in content_type:
-        print(f"🚫 Detected ZIP file via Content-Type: {content_type} - returning None")
-        return None, None
-
-    # If we got a size and it's too large, reject immediately
-    if file_size is not None and file_size > MAX_FILE_SIZE:
-        print(f"🚫 Rejecting file: {format_file_size(file_size)} exceeds limit")
-        return None, None
+        return (*_entry_to_content(cache_data), True)
+
+    if cache_data is not None:
+        print("⏳ Cached content is stale - revalidating")
+        response = conditional_get(url, cache_data)
+
+        if response is None:
+            # Origin unreachable: serving the last known content beats failing
+            print("⚠️  Revalidation failed - serving stale cached content")
+            return (*_entry_to_content(cache_data), True)
+
+        if response.status_code == 304:
+            response.close()
+            print("✅ 304 Not Modified - cached content is still valid")
+            touch_cache_entry(url, cache_data, extract_validators(response.headers))
+            return (*_entry_to_content(cache_data), True)
+
+        if response.status_code >= 400:
+            response.close()
+            if response.status_code in (404, 410):
+                print(f"🗑️  Document is gone (HTTP {response.status_code}) - dropping cached content")
+                delete_cached_content(url)
+            else:
+                print(f"❌ Revalidation rejected: HTTP {response.status_code}")
+            return None, None, False
 
-    # Choose download method based on whether we have size info
-    if file_size is not None:
-        # We know the size is OK, download directly
-        temp_file_path = download_file_direct(url)
+        print("🔄 Content may have changed - downloading new version")
+        headers = dict(response.headers)
+        try:
+            with profile_stage("download"):
+                temp_file_path = write_response_to_temp_file(response)
+        except requests.RequestException as e:
+            # Connection dropped mid-stream: the origin is effectively unreachable
+            print(f"❌ Error downloading new version: {e} - serving stale cached content")
+            return (*_entry_to_content(cache_data), True)
     else:
-        # Unknown size, use streaming with monitoring
-        print("⚠️  File size unknown - using streaming download with monitoring")
-        temp_file_path = download_with_size_limit(url)
+        print("🆕 No cache found - processing new URL")
+
+        # Get file info using HEAD request
+        file_size, headers = get_file_info(url)
+
+        # Check content-type for zip files as additional safety
+        content_type = headers.get("content-type", "").lower()
+        # Only plain archives; EPUB (application/epub+zip) is a ZIP container too
+        if content_type.split(";")[0].strip() in ("application/zip", "application/x-zip-compressed"):
+            print(f"🚫 Detected ZIP file via Content-Type: {content_type} - returning None")
+            return None, None, False
+
+        # If we got a size and it's too large, reject immediately
+        if file_size is not None and file_size > MAX_FILE_SIZE:
+            print(f"🚫 Rejecting file: {format_file_size(file_size)} exceeds limit")
+            return None, None, False
+
+        # Choose download method based on whether we have size info
+        with profile_stage("download"):
+            if file_size is not None:
+                # We know the size is OK, download directly
+                temp_file_path = download_file_direct(url)
+            else:
+                # Unknown size, use streaming with monitoring
+                print("⚠️  File size unknown - using streaming download with monitoring")
+                temp_file_path = download_with_size_limit(url)
 
     if not temp_file_path:
         print("❌ Download failed")
-        return None, None
+        return None, None, False
 
     try:
-        # Determine processing strategy
-        processing_strategy = determine_processing_strategy(
-            url, temp_file_path, headers
-        )
+        validators = extract_validators(headers)
+        validators["content_hash"] = hash_file(temp_file_path)
+
+        # Servers without validators (or with weak ones) may resend identical bytes
+        if cache_data is not None and cache_data.get("content_hash") == validators["content_hash"]:
+            print("✅ Downloaded content is unchanged - reusing cached conversion")
+            touch_cache_entry(url, cache_data, validators)
+            return (*_entry_to_content(cache_data), True)
+
+        # Sniff the real format from the file content and determine processing strategy
+        with profile_stage("detect"):
+            content_type = {k.lower(): v for k, v in headers.items()}.get("content-type")
+            detected = detect_format(temp_file_path, filename_hint=url, content_type=content_type)
+        annotate_profile(file_type=detected.format)
+        processing_strategy = determine_processing_strategy(detected)
+        annotate_profile(processing_strategy=processing_strategy)
 
         # For batch_pdf, return early without generating markdown
         if processing_strategy == "batch_pdf":
             print("⚡ Early return for batch_pdf - no markdown generation needed")
             # Cache the batch_pdf result (with None content)
             print("💾 Saving batch_pdf result to cache...")
-            save_to_cache(url, "", processing_strategy)  # Empty string for batch_pdf
-            return None, processing_strategy
+            save_to_cache(url, "", processing_strategy, validators)  # Empty string for batch_pdf
+            return None, processing_strategy, False
 
         # For rag and batch_text, generate markdown content
         print("🔄 Processing file with MarkItDown...")
         start_time = time.time()
-        result = md.convert(temp_file_path)
+        with profile_stage("convert"):
+            markdown_content = convert_detected(
+                md, converter_registry, temp_file_path, detected, **converter_kwargs
+            )
         processing_time = time.time() - start_time
 
-        markdown_content = result.text_content
+        markdown_content = postprocess_markdown(markdown_content)
         content_length = len(markdown_content)
 
         # Cache the result
         print("💾 Saving to cache...")
-        save_to_cache(url, markdown_content, processing_strategy)
+        save_to_cache(url, markdown_content, processing_strategy, validators)
 
         print(f"✅ Successfully processed in {processing_time:.2f} seconds")
         print(f"📝 Generated markdown content: {content_length:,} characters")
-        return markdown_content, processing_strategy
+        return markdown_content, processing_strategy, False
+
+    except UnsupportedFormatError as e:
+        print(f"🚫 Rejected file: {e}")
+        return None, None, False
 
     except Exception as e:
         print(f"❌ Error processing file: {e}")
-        return None, None
+        return None, None, False
 
     finally:
         # Clean up temporary file